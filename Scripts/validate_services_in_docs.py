@@ -8,20 +8,29 @@ Exit code 0 when all referenced services are present; non-zero if mismatches fou
 """
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import yaml
 
+# Prefer the libyaml-backed parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 ROOT = Path(__file__).resolve().parents[1]
 COMPOSE = ROOT / 'docker-compose.yml'
 DOCS = ROOT / 'docs'
 
-svc_pattern = re.compile(r"(?:docker\s+compose|docker-compose)\s+up(\s+[^\n`]+)")
+# Byte patterns: the docs are scanned without decoding them (the patterns are ASCII-only)
+svc_pattern = re.compile(rb"(?:docker\s+compose|docker-compose)\s+up(\s+[^\n`]+)")
+ws_pattern = re.compile(rb"\s+")
 
 def load_compose_services():
     if not COMPOSE.exists():
         print(f"docker-compose file not found: {COMPOSE}")
         sys.exit(2)
-    data = yaml.safe_load(COMPOSE.read_text())
+    data = yaml.load(COMPOSE.read_text(), Loader=YamlLoader)
     services = data.get('services') or {}
     return set(services.keys())
 
@@ -29,19 +38,21 @@ def find_doc_service_references():
     refs = set()
     if not DOCS.exists():
         return refs
-    for p in DOCS.rglob('*.md'):
-        text = p.read_text()
+    # Reads are independent and I/O-bound, so overlap them on a thread pool
+    with ThreadPoolExecutor() as pool:
+        texts = list(pool.map(Path.read_bytes, DOCS.rglob('*.md')))
+    for text in texts:
         for m in svc_pattern.finditer(text):
             tail = m.group(1)
             # split tokens, ignore flags (starting with '-') and code fences
-            tokens = [t for t in re.split(r"\s+", tail.strip()) if t and not t.startswith('-')]
+            tokens = [t for t in ws_pattern.split(tail.strip()) if t and not t.startswith(b'-')]
             for t in tokens:
                 # stop at markdown/code fence markers
-                if t.startswith('```'):
+                if t.startswith(b'```'):
                     break
                 # remove trailing punctuation
-                t = t.rstrip('`,.')
-                refs.add(t)
+                t = t.rstrip(b'`,.')
+                refs.add(t.decode('utf-8', 'replace'))
     return refs
 
 def main():
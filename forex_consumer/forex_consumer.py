@@ -1,7 +1,7 @@
 import json
 import os
 from kafka import KafkaConsumer
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, table, column, insert
 from sqlalchemy.orm import sessionmaker
 
 # Environment setup
@@ -40,15 +40,22 @@ consumer = KafkaConsumer(
     value_deserializer=lambda m: json.loads(m.decode('utf-8'))
 )
 
+# Lightweight Core table for inserts; the DDL above stays the source of truth
+forex_raw = table(
+    'forex_raw',
+    column('timestamp'), column('pair_name'), column('bid_price'), column('ask_price'), column('spread'),
+    schema='forex_data'
+)
+INSERT_TICK = insert(forex_raw)
+
 # Helper function to insert batch
 def insert_batch(session, batch):
     if not batch:
         return
-    for tick in batch:
-        session.execute(text("""
-            INSERT INTO forex_data.forex_raw (timestamp, pair_name, bid_price, ask_price, spread)
-            VALUES (:timestamp, :pair_name, :bid_price, :ask_price, :spread)
-        """), tick)
+    # A Core insert() with a list of parameter sets uses SQLAlchemy's
+    # insertmanyvalues, so psycopg2 sends multi-row INSERT ... VALUES
+    # statements rather than one INSERT per tick
+    session.execute(INSERT_TICK, batch)
     session.commit()
     print(f"Inserted {len(batch)} records")
 
@@ -1,43 +1,241 @@
+import random
 import time
+from contextlib import contextmanager
+from datetime import date
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from prepared_layers.utils import (
     get_logger, POSTGRES_HOST, POSTGRES_PORT, 
-    POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB_ANALYTICS
+    POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB_ANALYTICS, POSTGRES_DB_PROD,
+    POSTGRES_FDW_HOST, POSTGRES_FDW_PORT
 )
 
 logger = get_logger(__name__)
 
+# Time-series tables range-partitioned by month on datetime
+PARTITIONED_TABLES = (
+    'cdr_usage_summary_15min', 'cdr_usage_summary_30min', 'cdr_usage_summary_1hr',
+    'forex_ohlc_m1', 'forex_ohlc_m30', 'forex_ohlc_h1',
+)
+
+# prod crm_system tables imported into the crm_fdw schema
+CRM_FOREIGN_TABLES = ('accounts', 'devices', 'addresses')
+
+# Connections are kept open between scheduled runs, one pool per database
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+_pools = {}
+
+
+def _get_pool(database: str) -> ThreadedConnectionPool:
+    """Return the connection pool for a database, creating it on first use."""
+    pool = _pools.get(database)
+    if pool is None:
+        pool = ThreadedConnectionPool(
+            POOL_MIN_CONNECTIONS,
+            POOL_MAX_CONNECTIONS,
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD,
+            database=database
+        )
+        _pools[database] = pool
+    return pool
+
+
+def _connection_alive(conn) -> bool:
+    """Round-trip a pooled connection; psycopg2 only sets closed after a failure."""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.OperationalError:
+        return False
+
+
 def get_db_connection(database: str):
-    """Create and return a database connection."""
+    """Check out a pooled database connection; return it with release_db_connection."""
     for attempt in range(10):
         try:
-            conn = psycopg2.connect(
-                host=POSTGRES_HOST,
-                port=POSTGRES_PORT,
-                user=POSTGRES_USER,
-                password=POSTGRES_PASSWORD,
-                database=database
-            )
+            pool = _get_pool(database)
+            conn = pool.getconn()
+            if not _connection_alive(conn):
+                # Dropped server-side since the last checkout (e.g. Postgres
+                # restarted); the pool keeps one idle connection, so the
+                # replacement is a fresh connect that backs off on failure
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
             return conn
-        except Exception as e:
-            logger.error(f"Failed to connect to {database} (attempt {attempt + 1}/10): {e}")
-            time.sleep(5)
+        except psycopg2.OperationalError as e:
+            # Exponential backoff with jitter: fast first retries, capped at 5s.
+            # Anything other than a connection failure is raised as-is.
+            delay = min(5, 0.1 * 2 ** attempt) + random.uniform(0, 0.1)
+            logger.error(f"Failed to connect to {database} (attempt {attempt + 1}/10, retrying in {delay:.2f}s): {e}")
+            time.sleep(delay)
     raise Exception(f"Could not connect to {database} after 10 attempts")
 
 
+def release_db_connection(database: str, conn):
+    """Return a connection to its pool, rolling back any open transaction."""
+    pool = _pools.get(database)
+    if pool is None:
+        conn.close()
+        return
+    pool.putconn(conn)
+
+
+@contextmanager
+def db_conn(database: str):
+    """Check out a pooled connection for the duration of a with-block."""
+    conn = get_db_connection(database)
+    try:
+        yield conn
+    finally:
+        release_db_connection(database, conn)
+
+
+def ensure_monthly_partitions(cursor, table_name: str, start, end):
+    """
+    Create the monthly partitions of table_name covering start..end, if missing.
+    
+    Existing partitions are read once from pg_inherits and the missing ones are
+    created in a single round-trip, so layers that rewrite their full history
+    each run don't resend one CREATE per month.
+    """
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table_name,))
+    existing = {r[0] for r in cursor.fetchall()}
+    base_name = table_name.rsplit('.', 1)[-1]
+    
+    statements, params = [], []
+    month = date(start.year, start.month, 1)
+    while month <= date(end.year, end.month, 1):
+        next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        if f"{base_name}_{month:%Y_%m}" not in existing:
+            statements.append(f"""
+                CREATE TABLE IF NOT EXISTS {table_name}_{month:%Y_%m}
+                PARTITION OF {table_name}
+                FOR VALUES FROM (%s) TO (%s)
+            """)
+            params.extend((month, next_month))
+        month = next_month
+    if statements:
+        cursor.execute(";".join(statements), params)
+
+
+def _rename_unpartitioned(cursor, table: str) -> bool:
+    """
+    Move a time-series table created before partitioning aside as {table}_old.
+    
+    Its indexes (including the primary key) are renamed too so the partitioned
+    table's CREATE ... IF NOT EXISTS statements don't find them and skip.
+    Returns True if the table was renamed.
+    """
+    cursor.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'prepared_layers' AND c.relname = %s
+    """, (table,))
+    row = cursor.fetchone()
+    if row is None or row[0] != 'r':
+        return False
+    
+    cursor.execute("""
+        SELECT i.relname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+    """, (f'prepared_layers.{table}',))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"ALTER INDEX prepared_layers.{index_name} RENAME TO {index_name}_old")
+    cursor.execute(f"ALTER TABLE prepared_layers.{table} RENAME TO {table}_old")
+    return True
+
+
+def _copy_into_partitioned(cursor, table: str):
+    """Copy {table}_old into the new partitioned table, then drop it."""
+    old_table = f'prepared_layers.{table}_old'
+    new_table = f'prepared_layers.{table}'
+    
+    cursor.execute(f"SELECT MIN(datetime), MAX(datetime) FROM {old_table}")
+    start, end = cursor.fetchone()
+    if start is not None:
+        ensure_monthly_partitions(cursor, new_table, start, end)
+        # The old tables had an id column the partitioned ones don't
+        cursor.execute("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = 'prepared_layers' AND table_name = %s
+              AND column_name IN (
+                  SELECT column_name
+                  FROM information_schema.columns
+                  WHERE table_schema = 'prepared_layers' AND table_name = %s
+              )
+            ORDER BY ordinal_position
+        """, (table, f'{table}_old'))
+        columns = ", ".join(r[0] for r in cursor.fetchall())
+        cursor.execute(f"""
+            INSERT INTO {new_table} ({columns})
+            SELECT {columns} FROM {old_table}
+            ON CONFLICT DO NOTHING
+        """)
+    cursor.execute(f"DROP TABLE {old_table}")
+    logger.info(f"Migrated {new_table} to a partitioned table")
+
+
+def _drop_stale_crm_table(cursor) -> bool:
+    """
+    Drop a crm_flattened_balance left by the old per-run DROP/CREATE loader.
+    
+    That table has plain total_cost_zar/running_balance_zar columns, which
+    nothing maintains any more; it is recreated with generated columns.
+    Returns True if the table was dropped.
+    """
+    cursor.execute("""
+        SELECT attgenerated
+        FROM pg_attribute
+        WHERE attrelid = to_regclass('prepared_layers.crm_flattened_balance')
+          AND attname = 'total_cost_zar'
+          AND NOT attisdropped
+    """)
+    row = cursor.fetchone()
+    if row is None or row[0] != '':
+        return False
+    cursor.execute("DROP TABLE prepared_layers.crm_flattened_balance")
+    return True
+
+
 def create_prepared_layer_tables():
     """Create all prepared layer tables if they don't exist."""
     conn = get_db_connection(POSTGRES_DB_ANALYTICS)
     cursor = conn.cursor()
     
     try:
-
-        cursor.execute("CREATE SCHEMA IF NOT EXISTS prepared_layers;")
+        # Deployments from before partitioning have these as plain tables, which
+        # CREATE TABLE IF NOT EXISTS would keep; move them aside and copy them
+        # into the partitioned tables below, all in this transaction
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS prepared_layers")
+        migrating = [t for t in PARTITIONED_TABLES if _rename_unpartitioned(cursor, t)]
+        rebuild_crm = _drop_stale_crm_table(cursor)
         
-        # CDR Data - 1: Time-based summaries (15min, 30min, 1hr)
-        cursor.execute("""
+        # All DDL goes to the server as one multi-statement script (one round-trip)
+        ddl = "\n".join([
+            "CREATE SCHEMA IF NOT EXISTS prepared_layers;",
+
+            # CDR Data - 1: Time-based summaries (15min, 30min, 1hr).
+            # Time-series tables are range-partitioned by month on datetime;
+            # partitions are created on demand by ensure_monthly_partitions.
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.cdr_usage_summary_15min (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 msisdn VARCHAR(20) NOT NULL,
                 -- Call statistics by type
@@ -58,15 +256,14 @@ def create_prepared_layer_tables():
                 total_up_bytes BIGINT DEFAULT 0,
                 total_down_bytes BIGINT DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, msisdn)
-            );
-            CREATE INDEX IF NOT EXISTS idx_cdr_summary_15min_datetime ON prepared_layers.cdr_usage_summary_15min(datetime);
+                PRIMARY KEY (datetime, msisdn)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_cdr_summary_15min_datetime ON prepared_layers.cdr_usage_summary_15min USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_cdr_summary_15min_msisdn ON prepared_layers.cdr_usage_summary_15min(msisdn);
-        """)
-        
-        cursor.execute("""
+            """,
+
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.cdr_usage_summary_30min (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 msisdn VARCHAR(20) NOT NULL,
                 voice_call_count INTEGER DEFAULT 0,
@@ -85,15 +282,14 @@ def create_prepared_layer_tables():
                 total_up_bytes BIGINT DEFAULT 0,
                 total_down_bytes BIGINT DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, msisdn)
-            );
-            CREATE INDEX IF NOT EXISTS idx_cdr_summary_30min_datetime ON prepared_layers.cdr_usage_summary_30min(datetime);
+                PRIMARY KEY (datetime, msisdn)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_cdr_summary_30min_datetime ON prepared_layers.cdr_usage_summary_30min USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_cdr_summary_30min_msisdn ON prepared_layers.cdr_usage_summary_30min(msisdn);
-        """)
-        
-        cursor.execute("""
+            """,
+
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.cdr_usage_summary_1hr (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 msisdn VARCHAR(20) NOT NULL,
                 voice_call_count INTEGER DEFAULT 0,
@@ -112,15 +308,27 @@ def create_prepared_layer_tables():
                 total_up_bytes BIGINT DEFAULT 0,
                 total_down_bytes BIGINT DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, msisdn)
-            );
-            CREATE INDEX IF NOT EXISTS idx_cdr_summary_1hr_datetime ON prepared_layers.cdr_usage_summary_1hr(datetime);
+                PRIMARY KEY (datetime, msisdn)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_cdr_summary_1hr_datetime ON prepared_layers.cdr_usage_summary_1hr USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_cdr_summary_1hr_msisdn ON prepared_layers.cdr_usage_summary_1hr(msisdn);
-        """)
-        
-        # CDR Data - 2: Tower sessions
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS prepared_layers.cdr_tower_sessions (
+            """,
+
+            # Per-msisdn usage totals rolled up from the hourly summaries; feeds CRM balances
+            """
+            CREATE TABLE IF NOT EXISTS prepared_layers.cdr_msisdn_totals (
+                msisdn VARCHAR(20) PRIMARY KEY,
+                total_bytes BIGINT DEFAULT 0,
+                total_seconds BIGINT DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+
+            # CDR Data - 2: Tower sessions. Truncated and rebuilt on every run, so
+            # it is UNLOGGED: no WAL for the reload, and a crash only empties it
+            # until the next run.
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS prepared_layers.cdr_tower_sessions (
                 id SERIAL PRIMARY KEY,
                 msisdn VARCHAR(20) NOT NULL,
                 tower_id INTEGER NOT NULL,
@@ -132,10 +340,41 @@ def create_prepared_layer_tables():
             CREATE INDEX IF NOT EXISTS idx_tower_sessions_msisdn ON prepared_layers.cdr_tower_sessions(msisdn);
             CREATE INDEX IF NOT EXISTS idx_tower_sessions_tower_id ON prepared_layers.cdr_tower_sessions(tower_id);
             CREATE INDEX IF NOT EXISTS idx_tower_sessions_start ON prepared_layers.cdr_tower_sessions(session_start);
-        """)
-        
-        # CRM Data - 1: Flattened CRM with running balance
-        cursor.execute("""
+            ALTER TABLE prepared_layers.cdr_tower_sessions SET UNLOGGED;
+            """,
+
+            # CRM Data - 1: Flattened CRM records, upserted incrementally by process_crm_data_1
+            """
+            CREATE TABLE IF NOT EXISTS prepared_layers.crm_flattened_balance (
+                account_id INTEGER,
+                owner_name VARCHAR(255),
+                email VARCHAR(255),
+                msisdn VARCHAR(20),
+                device_id INTEGER,
+                device_name VARCHAR(255),
+                device_type VARCHAR(50),
+                device_os VARCHAR(50),
+                street_address VARCHAR(500),
+                city VARCHAR(100),
+                state VARCHAR(50),
+                postal_code VARCHAR(20),
+                country VARCHAR(50),
+                last_modified TIMESTAMP,
+                total_data_bytes BIGINT DEFAULT 0,
+                data_cost_zar DECIMAL(10,2) DEFAULT 0,
+                total_call_seconds INTEGER DEFAULT 0,
+                voice_cost_zar DECIMAL(10,2) DEFAULT 0,
+                total_cost_zar DECIMAL(15,4) GENERATED ALWAYS AS (data_cost_zar + voice_cost_zar) STORED,
+                running_balance_zar DECIMAL(15,4) GENERATED ALWAYS AS (-(data_cost_zar + voice_cost_zar)) STORED,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, device_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_crm_flattened_msisdn ON prepared_layers.crm_flattened_balance(msisdn);
+            CREATE INDEX IF NOT EXISTS idx_crm_flattened_account ON prepared_layers.crm_flattened_balance(account_id);
+            """,
+
+            # CRM Data - 1: Flattened CRM with running balance
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.crm_user_balance_hourly (
                 id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
@@ -170,78 +409,89 @@ def create_prepared_layer_tables():
             );
             CREATE INDEX IF NOT EXISTS idx_crm_balance_datetime ON prepared_layers.crm_user_balance_hourly(datetime);
             CREATE INDEX IF NOT EXISTS idx_crm_balance_account ON prepared_layers.crm_user_balance_hourly(account_id);
-        """)
-        
-        # Forex Data - 1: OHLC summaries with technical indicators
-        cursor.execute("""
+            """,
+
+            # Forex Data - 1: OHLC summaries with technical indicators (partitioned like CDR Data - 1)
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.forex_ohlc_m1 (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 pair_name VARCHAR(20) NOT NULL,
                 open_price DECIMAL(10, 4) NOT NULL,
                 high_price DECIMAL(10, 4) NOT NULL,
                 low_price DECIMAL(10, 4) NOT NULL,
                 close_price DECIMAL(10, 4) NOT NULL,
-                ema_8 DECIMAL(10, 4),
-                ema_21 DECIMAL(10, 4),
-                atr_8 DECIMAL(10, 4),
-                atr_21 DECIMAL(10, 4),
+                ema_8 DOUBLE PRECISION,
+                ema_21 DOUBLE PRECISION,
+                atr_8 DOUBLE PRECISION,
+                atr_21 DOUBLE PRECISION,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, pair_name)
-            );
-            CREATE INDEX IF NOT EXISTS idx_forex_m1_datetime ON prepared_layers.forex_ohlc_m1(datetime);
+                PRIMARY KEY (datetime, pair_name)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_forex_m1_datetime ON prepared_layers.forex_ohlc_m1 USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_forex_m1_pair ON prepared_layers.forex_ohlc_m1(pair_name);
-        """)
-        
-        cursor.execute("""
+            """,
+
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.forex_ohlc_m30 (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 pair_name VARCHAR(20) NOT NULL,
                 open_price DECIMAL(10, 4) NOT NULL,
                 high_price DECIMAL(10, 4) NOT NULL,
                 low_price DECIMAL(10, 4) NOT NULL,
                 close_price DECIMAL(10, 4) NOT NULL,
-                ema_8 DECIMAL(10, 4),
-                ema_21 DECIMAL(10, 4),
-                atr_8 DECIMAL(10, 4),
-                atr_21 DECIMAL(10, 4),
+                ema_8 DOUBLE PRECISION,
+                ema_21 DOUBLE PRECISION,
+                atr_8 DOUBLE PRECISION,
+                atr_21 DOUBLE PRECISION,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, pair_name)
-            );
-            CREATE INDEX IF NOT EXISTS idx_forex_m30_datetime ON prepared_layers.forex_ohlc_m30(datetime);
+                PRIMARY KEY (datetime, pair_name)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_forex_m30_datetime ON prepared_layers.forex_ohlc_m30 USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_forex_m30_pair ON prepared_layers.forex_ohlc_m30(pair_name);
-        """)
-        
-        cursor.execute("""
+            """,
+
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.forex_ohlc_h1 (
-                id SERIAL PRIMARY KEY,
                 datetime TIMESTAMP NOT NULL,
                 pair_name VARCHAR(20) NOT NULL,
                 open_price DECIMAL(10, 4) NOT NULL,
                 high_price DECIMAL(10, 4) NOT NULL,
                 low_price DECIMAL(10, 4) NOT NULL,
                 close_price DECIMAL(10, 4) NOT NULL,
-                ema_8 DECIMAL(10, 4),
-                ema_21 DECIMAL(10, 4),
-                atr_8 DECIMAL(10, 4),
-                atr_21 DECIMAL(10, 4),
+                ema_8 DOUBLE PRECISION,
+                ema_21 DOUBLE PRECISION,
+                atr_8 DOUBLE PRECISION,
+                atr_21 DOUBLE PRECISION,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(datetime, pair_name)
-            );
-            CREATE INDEX IF NOT EXISTS idx_forex_h1_datetime ON prepared_layers.forex_ohlc_h1(datetime);
+                PRIMARY KEY (datetime, pair_name)
+            ) PARTITION BY RANGE (datetime);
+            CREATE INDEX IF NOT EXISTS idx_forex_h1_datetime ON prepared_layers.forex_ohlc_h1 USING BRIN (datetime);
             CREATE INDEX IF NOT EXISTS idx_forex_h1_pair ON prepared_layers.forex_ohlc_h1(pair_name);
-        """)
-        
-        # Processing state tracking table
-        cursor.execute("""
+            """,
+
+            # Processing state tracking table
+            """
             CREATE TABLE IF NOT EXISTS prepared_layers.processing_state (
                 id SERIAL PRIMARY KEY,
                 layer_name VARCHAR(100) UNIQUE NOT NULL,
                 last_processed_datetime TIMESTAMP,
                 last_run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
-        """)
+            """,
+        ])
+        
+        cursor.execute(ddl)
+        
+        for table in migrating:
+            _copy_into_partitioned(cursor, table)
+        if rebuild_crm:
+            # Reset the CRM Data - 1 watermark (CRM_LAYER_NAME) so the next
+            # run re-flattens every account into the new table
+            cursor.execute("""
+                DELETE FROM prepared_layers.processing_state
+                WHERE layer_name = 'crm_flattened_balance'
+            """)
+            logger.info("Rebuilt prepared_layers.crm_flattened_balance with generated cost columns")
         
         conn.commit()
         logger.info("Successfully created all prepared layer tables")
@@ -252,4 +502,86 @@ def create_prepared_layer_tables():
         raise
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(POSTGRES_DB_ANALYTICS, conn)
+
+
+def setup_crm_foreign_tables() -> bool:
+    """
+    Expose the prod CRM tables in the analytics database via postgres_fdw.
+    
+    CRM Data - 1 flattens from these foreign tables server-side. Runs in its
+    own transaction after the core DDL so an unreachable prod database only
+    disables CRM Data - 1. Returns True when the foreign tables are usable.
+    """
+    conn = get_db_connection(POSTGRES_DB_ANALYTICS)
+    cursor = conn.cursor()
+    
+    # fetch_size streams remote rows in large batches instead of 100 at a time
+    server_options = {
+        'host': POSTGRES_FDW_HOST,
+        'port': str(POSTGRES_FDW_PORT),
+        'dbname': POSTGRES_DB_PROD,
+        'fetch_size': '10000',
+    }
+    
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+        
+        # Update an existing server in place so its foreign tables survive restarts
+        cursor.execute("SELECT srvoptions FROM pg_foreign_server WHERE srvname = 'prod_server'")
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("""
+                CREATE SERVER prod_server
+                    FOREIGN DATA WRAPPER postgres_fdw
+                    OPTIONS (host %s, port %s, dbname %s, fetch_size %s)
+            """, tuple(server_options.values()))
+        else:
+            existing = {option.split('=', 1)[0] for option in row[0] or []}
+            actions = ", ".join(
+                f"{'SET' if name in existing else 'ADD'} {name} %s" for name in server_options
+            )
+            cursor.execute(f"ALTER SERVER prod_server OPTIONS ({actions})", tuple(server_options.values()))
+        
+        cursor.execute("""
+            CREATE USER MAPPING IF NOT EXISTS FOR CURRENT_USER
+                SERVER prod_server
+                OPTIONS (user %s, password %s)
+        """, (POSTGRES_USER, POSTGRES_PASSWORD))
+        cursor.execute("""
+            ALTER USER MAPPING FOR CURRENT_USER
+                SERVER prod_server
+                OPTIONS (SET user %s, SET password %s)
+        """, (POSTGRES_USER, POSTGRES_PASSWORD))
+        
+        # Import only the foreign tables that are missing; drop one to re-import
+        # it after a prod schema change
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS crm_fdw")
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'crm_fdw' AND c.relkind = 'f'
+        """)
+        imported = {r[0] for r in cursor.fetchall()}
+        missing = [t for t in CRM_FOREIGN_TABLES if t not in imported]
+        if missing:
+            cursor.execute(f"""
+                IMPORT FOREIGN SCHEMA crm_system LIMIT TO ({', '.join(missing)})
+                    FROM SERVER prod_server INTO crm_fdw
+            """)
+        
+        # Fail here rather than on every CRM run if prod is unreachable
+        cursor.execute("SELECT 1 FROM crm_fdw.accounts LIMIT 1")
+        
+        conn.commit()
+        logger.info("CRM foreign tables ready")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Could not set up CRM foreign tables, CRM Data - 1 disabled: {e}")
+        return False
+    finally:
+        cursor.close()
+        release_db_connection(POSTGRES_DB_ANALYTICS, conn)
@@ -2,10 +2,8 @@
 CRM Data Prepared Layer
 Creates flattened CRM data with balance calculations.
 """
-import pandas as pd
-from psycopg2.extras import execute_values
-from prepared_layers.utils import get_logger, POSTGRES_DB_ANALYTICS, POSTGRES_DB_PROD
-from prepared_layers.database import get_db_connection
+from prepared_layers.utils import get_logger, POSTGRES_DB_ANALYTICS
+from prepared_layers.database import db_conn
 
 logger = get_logger(__name__)
 
@@ -13,10 +11,16 @@ logger = get_logger(__name__)
 DATA_COST_PER_GB = 49  # ZAR per GB
 VOICE_COST_PER_MIN = 1  # ZAR per minute
 
+# processing_state key for the CRM Data - 1 watermark
+CRM_LAYER_NAME = 'crm_flattened_balance'
+
+# processing_state key for the cdr_msisdn_totals watermark
+TOTALS_LAYER_NAME = 'cdr_msisdn_totals'
+
 
 def process_crm_data_1():
     """
-    Process CRM Data - 1: Create flattened CRM table with balance calculations.
+    Process CRM Data - 1: Maintain flattened CRM table with balance calculations.
     
     Combines:
     - Account information (account_id, owner_name, email, msisdn)
@@ -24,142 +28,118 @@ def process_crm_data_1():
     - Address information (street_address, city, state, postal_code, country)
     - Cost calculation placeholders (ready for CDR data)
     - Running balance per hour
+    
+    Only accounts whose account, device or address changed since the last run
+    are re-flattened and upserted; the watermark lives in processing_state.
+    Rows whose account or device no longer exists in prod are deleted.
     """
     logger.info("Processing CRM Data - 1 (Flattened + Balance Summary)")
     
-    conn_prod = get_db_connection(POSTGRES_DB_PROD)
-    conn_analytics = get_db_connection(POSTGRES_DB_ANALYTICS)
-    
-    try:
-        # Read CRM data from production database
-        query = """
-        SELECT 
-            a.account_id,
-            a.owner_name,
-            a.email,
-            a.phone_number as msisdn,
-            d.device_id,
-            d.device_name,
-            d.device_type,
-            d.device_os,
-            addr.street_address,
-            addr.city,
-            addr.state,
-            addr.postal_code,
-            addr.country,
-            GREATEST(a.modified_ts, d.modified_ts, addr.modified_ts) as last_modified
-        FROM crm_system.accounts a
-        LEFT JOIN crm_system.devices d ON a.account_id = d.account_id
-        LEFT JOIN crm_system.addresses addr ON a.account_id = addr.account_id
-        WHERE a.phone_number IS NOT NULL
-        ORDER BY a.account_id, d.device_id
-        """
-        
-        logger.info("Reading CRM data from production database...")
-        df = pd.read_sql(query, conn_prod)
-        logger.info(f"Read {len(df)} CRM records")
-        
-        if len(df) == 0:
-            logger.warning("No CRM data found")
-            return
-        
-        # Add cost calculation fields (placeholders for now, will be updated by CDR processing)
-        df['total_data_bytes'] = 0
-        df['data_cost_zar'] = 0.0
-        df['total_call_seconds'] = 0
-        df['voice_cost_zar'] = 0.0
-        df['total_cost_zar'] = 0.0
-        df['running_balance_zar'] = 0.0
-        df['created_at'] = pd.Timestamp.now()
-        
-        # Create or replace the flattened table
-        cursor = conn_analytics.cursor()
-        
-        # Drop and recreate table
-        logger.info("Creating prepared_layers.crm_flattened_balance table...")
-        cursor.execute("""
-        DROP TABLE IF EXISTS prepared_layers.crm_flattened_balance CASCADE;
-        
-        CREATE TABLE prepared_layers.crm_flattened_balance (
-            account_id INTEGER,
-            owner_name VARCHAR(255),
-            email VARCHAR(255),
-            msisdn VARCHAR(20),
-            device_id INTEGER,
-            device_name VARCHAR(255),
-            device_type VARCHAR(50),
-            device_os VARCHAR(50),
-            street_address VARCHAR(500),
-            city VARCHAR(100),
-            state VARCHAR(50),
-            postal_code VARCHAR(20),
-            country VARCHAR(50),
-            last_modified TIMESTAMP,
-            total_data_bytes BIGINT DEFAULT 0,
-            data_cost_zar DECIMAL(10,2) DEFAULT 0,
-            total_call_seconds INTEGER DEFAULT 0,
-            voice_cost_zar DECIMAL(10,2) DEFAULT 0,
-            total_cost_zar DECIMAL(10,2) DEFAULT 0,
-            running_balance_zar DECIMAL(10,2) DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (account_id, device_id)
-        );
-        
-        CREATE INDEX idx_crm_flattened_msisdn ON prepared_layers.crm_flattened_balance(msisdn);
-        CREATE INDEX idx_crm_flattened_account ON prepared_layers.crm_flattened_balance(account_id);
-        """)
-        conn_analytics.commit()
-        
-        # Insert data
-        logger.info(f"Inserting {len(df)} records into crm_flattened_balance...")
-        
-        # Prepare data for insertion
-        records = [tuple(row) for row in df.values]
-        columns = list(df.columns)
-        
-        insert_query = f"""
-        INSERT INTO prepared_layers.crm_flattened_balance 
-        ({', '.join(columns)})
-        VALUES %s
-        ON CONFLICT (account_id, device_id) 
-        DO UPDATE SET
-            owner_name = EXCLUDED.owner_name,
-            email = EXCLUDED.email,
-            msisdn = EXCLUDED.msisdn,
-            device_name = EXCLUDED.device_name,
-            device_type = EXCLUDED.device_type,
-            device_os = EXCLUDED.device_os,
-            street_address = EXCLUDED.street_address,
-            city = EXCLUDED.city,
-            state = EXCLUDED.state,
-            postal_code = EXCLUDED.postal_code,
-            country = EXCLUDED.country,
-            last_modified = EXCLUDED.last_modified
-        """
-        
-        execute_values(cursor, insert_query, records)
-        conn_analytics.commit()
-        
-        logger.info(f"✅ Successfully processed {len(df)} CRM records")
-        
-        # Show sample data
-        cursor.execute("""
-        SELECT account_id, owner_name, msisdn, device_name, city, state
-        FROM prepared_layers.crm_flattened_balance
-        LIMIT 5
-        """)
-        samples = cursor.fetchall()
-        logger.info("Sample records:")
-        for sample in samples:
-            logger.info(f"  Account {sample[0]}: {sample[1]} | {sample[2]} | {sample[3]} | {sample[4]}, {sample[5]}")
-        
-    except Exception as e:
-        logger.error(f"Error processing CRM data: {e}")
-        conn_analytics.rollback()
-        raise
-    finally:
-        conn_prod.close()
-        conn_analytics.close()
+    with db_conn(POSTGRES_DB_ANALYTICS) as conn_analytics, conn_analytics.cursor() as cursor:
+        try:
+            # Get the last processed modification time
+            cursor.execute("""
+            SELECT COALESCE(MAX(last_processed_datetime), '1970-01-01'::timestamp)
+            FROM prepared_layers.processing_state
+            WHERE layer_name = %s
+            """, (CRM_LAYER_NAME,))
+            last_processed = cursor.fetchone()[0]
+            
+            # Flatten changed rows server-side from the prod CRM foreign tables
+            # (see create_prepared_layer_tables). Cost columns keep their current
+            # values and are maintained by CDR processing.
+            logger.info(f"Flattening CRM changes since {last_processed}...")
+            cursor.execute("""
+            INSERT INTO prepared_layers.crm_flattened_balance (
+                account_id, owner_name, email, msisdn,
+                device_id, device_name, device_type, device_os,
+                street_address, city, state, postal_code, country,
+                last_modified
+            )
+            SELECT 
+                a.account_id,
+                a.owner_name,
+                a.email,
+                a.phone_number as msisdn,
+                d.device_id,
+                d.device_name,
+                d.device_type,
+                d.device_os,
+                addr.street_address,
+                addr.city,
+                addr.state,
+                addr.postal_code,
+                addr.country,
+                GREATEST(a.modified_ts, d.modified_ts, addr.modified_ts) as last_modified
+            FROM crm_fdw.accounts a
+            LEFT JOIN crm_fdw.devices d ON a.account_id = d.account_id
+            LEFT JOIN crm_fdw.addresses addr ON a.account_id = addr.account_id
+            WHERE a.phone_number IS NOT NULL
+              AND COALESCE(GREATEST(a.modified_ts, d.modified_ts, addr.modified_ts), 'infinity'::timestamp) > %s
+            ON CONFLICT (account_id, device_id) 
+            DO UPDATE SET
+                owner_name = EXCLUDED.owner_name,
+                email = EXCLUDED.email,
+                msisdn = EXCLUDED.msisdn,
+                device_name = EXCLUDED.device_name,
+                device_type = EXCLUDED.device_type,
+                device_os = EXCLUDED.device_os,
+                street_address = EXCLUDED.street_address,
+                city = EXCLUDED.city,
+                state = EXCLUDED.state,
+                postal_code = EXCLUDED.postal_code,
+                country = EXCLUDED.country,
+                last_modified = EXCLUDED.last_modified
+            """, (last_processed,))
+            row_count = cursor.rowcount
+            
+            if row_count:
+                # Advance the watermark to the newest change now in the table
+                cursor.execute("""
+                INSERT INTO prepared_layers.processing_state (layer_name, last_processed_datetime)
+                SELECT %s, MAX(last_modified) FROM prepared_layers.crm_flattened_balance
+                ON CONFLICT (layer_name) DO UPDATE SET
+                    last_processed_datetime = EXCLUDED.last_processed_datetime,
+                    last_run_at = CURRENT_TIMESTAMP
+                """, (CRM_LAYER_NAME,))
+            
+            # Deletes leave no modified_ts behind, so anti-join against prod for
+            # accounts or devices that were removed, or devices that moved account
+            cursor.execute("""
+            DELETE FROM prepared_layers.crm_flattened_balance f
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM crm_fdw.accounts a
+                JOIN crm_fdw.devices d ON a.account_id = d.account_id
+                WHERE a.phone_number IS NOT NULL
+                  AND a.account_id = f.account_id
+                  AND d.device_id = f.device_id
+            )
+            """)
+            deleted_count = cursor.rowcount
+            conn_analytics.commit()
+            
+            if row_count == 0 and deleted_count == 0:
+                logger.info("No CRM changes to process")
+                return
+            
+            logger.info(f"✅ Successfully processed {row_count} CRM records, removed {deleted_count}")
+            
+            # Show sample data
+            cursor.execute("""
+            SELECT account_id, owner_name, msisdn, device_name, city, state
+            FROM prepared_layers.crm_flattened_balance
+            LIMIT 5
+            """)
+            samples = cursor.fetchall()
+            logger.info("Sample records:")
+            for sample in samples:
+                logger.info(f"  Account {sample[0]}: {sample[1]} | {sample[2]} | {sample[3]} | {sample[4]}, {sample[5]}")
+            
+        except Exception as e:
+            logger.error(f"Error processing CRM data: {e}")
+            conn_analytics.rollback()
+            raise
 
 
 def update_crm_balances_from_cdr():
@@ -169,53 +149,67 @@ def update_crm_balances_from_cdr():
     """
     logger.info("Updating CRM balances with CDR data...")
     
-    conn = get_db_connection(POSTGRES_DB_ANALYTICS)
-    cursor = conn.cursor()
-    
-    try:
-        # Update data usage and costs
-        logger.info("Calculating data usage costs...")
-        cursor.execute(f"""
-        UPDATE prepared_layers.crm_flattened_balance crm
-        SET 
-            total_data_bytes = COALESCE(cdr_summary.total_bytes, 0),
-            data_cost_zar = COALESCE(cdr_summary.total_bytes, 0) * {DATA_COST_PER_GB} / 1073741824.0,
-            total_call_seconds = COALESCE(voice_summary.total_seconds, 0),
-            voice_cost_zar = COALESCE(voice_summary.total_seconds, 0) * {VOICE_COST_PER_MIN} / 60.0
-        FROM (
-            SELECT 
-                msisdn,
-                SUM(CAST(up_bytes AS BIGINT) + CAST(down_bytes AS BIGINT)) as total_bytes
-            FROM cdr_data.cdr_data
-            GROUP BY msisdn
-        ) cdr_summary
-        LEFT JOIN (
+    with db_conn(POSTGRES_DB_ANALYTICS) as conn, conn.cursor() as cursor:
+        try:
+            # Re-sum totals for msisdns whose hourly summaries changed since the
+            # last run. The latest bucket may have been re-aggregated, hence >=.
+            logger.info("Refreshing per-msisdn usage totals...")
+            cursor.execute("""
+            SELECT COALESCE(MAX(last_processed_datetime), '1970-01-01'::timestamp)
+            FROM prepared_layers.processing_state
+            WHERE layer_name = %s
+            """, (TOTALS_LAYER_NAME,))
+            last_processed = cursor.fetchone()[0]
+            
+            cursor.execute("""
+            INSERT INTO prepared_layers.cdr_msisdn_totals (msisdn, total_bytes, total_seconds)
             SELECT 
                 msisdn,
-                SUM(CAST(call_duration_sec AS INTEGER)) as total_seconds
-            FROM cdr_data.cdr_voice
+                SUM(total_up_bytes + total_down_bytes),
+                SUM(total_call_duration_sec)
+            FROM prepared_layers.cdr_usage_summary_1hr
+            WHERE msisdn IN (
+                SELECT msisdn
+                FROM prepared_layers.cdr_usage_summary_1hr
+                WHERE datetime >= %s
+            )
             GROUP BY msisdn
-        ) voice_summary ON cdr_summary.msisdn = voice_summary.msisdn
-        WHERE crm.msisdn = cdr_summary.msisdn;
-        """)
-        
-        # Update total cost and running balance
-        cursor.execute("""
-        UPDATE prepared_layers.crm_flattened_balance
-        SET 
-            total_cost_zar = data_cost_zar + voice_cost_zar,
-            running_balance_zar = -(data_cost_zar + voice_cost_zar)
-        WHERE total_data_bytes > 0 OR total_call_seconds > 0;
-        """)
-        
-        conn.commit()
-        
-        rows_updated = cursor.rowcount
-        logger.info(f"✅ Updated {rows_updated} CRM records with CDR costs")
-        
-    except Exception as e:
-        logger.error(f"Error updating CRM balances: {e}")
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+            ON CONFLICT (msisdn) DO UPDATE SET
+                total_bytes = EXCLUDED.total_bytes,
+                total_seconds = EXCLUDED.total_seconds,
+                updated_at = CURRENT_TIMESTAMP
+            """, (last_processed,))
+            
+            cursor.execute("""
+            INSERT INTO prepared_layers.processing_state (layer_name, last_processed_datetime)
+            SELECT %s, MAX(datetime) FROM prepared_layers.cdr_usage_summary_1hr
+            ON CONFLICT (layer_name) DO UPDATE SET
+                last_processed_datetime = EXCLUDED.last_processed_datetime,
+                last_run_at = CURRENT_TIMESTAMP
+            """, (TOTALS_LAYER_NAME,))
+            
+            # Update data usage and costs; total_cost_zar and running_balance_zar
+            # are generated columns and follow automatically
+            logger.info("Calculating data usage costs...")
+            cursor.execute(f"""
+            UPDATE prepared_layers.crm_flattened_balance crm
+            SET 
+                total_data_bytes = t.total_bytes,
+                data_cost_zar = t.total_bytes * {DATA_COST_PER_GB} / 1073741824.0,
+                total_call_seconds = t.total_seconds,
+                voice_cost_zar = t.total_seconds * {VOICE_COST_PER_MIN} / 60.0
+            FROM prepared_layers.cdr_msisdn_totals t
+            WHERE crm.msisdn = t.msisdn
+              AND (crm.total_data_bytes, crm.total_call_seconds)
+                  IS DISTINCT FROM (t.total_bytes, t.total_seconds);
+            """)
+            
+            conn.commit()
+            
+            rows_updated = cursor.rowcount
+            logger.info(f"✅ Updated {rows_updated} CRM records with CDR costs")
+            
+        except Exception as e:
+            logger.error(f"Error updating CRM balances: {e}")
+            conn.rollback()
+            raise
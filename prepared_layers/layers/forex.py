@@ -1,24 +1,89 @@
+import numpy as np
 import pandas as pd
 from psycopg2.extras import execute_values
-from prepared_layers.utils import get_logger, POSTGRES_DB_ANALYTICS
-from prepared_layers.database import get_db_connection
+from prepared_layers.utils import get_logger, POSTGRES_DB_ANALYTICS, EXECUTE_VALUES_PAGE_SIZE
+from prepared_layers.database import db_conn, ensure_monthly_partitions
 
 logger = get_logger(__name__)
 
+# Optional numba kernels for long series (fall back to pandas when missing)
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    # numba not installed; indicators use the pandas implementation
+    HAS_NUMBA = False
+
+# Series at least this long use the compiled kernels when numba is available
+NUMBA_MIN_LENGTH = 100_000
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _ewm_recursive(values, alpha):
+        """s[i] = alpha * x[i] + (1 - alpha) * s[i-1], i.e. ewm(adjust=False)."""
+        out = np.empty_like(values)
+        out[0] = values[0]
+        for i in range(1, values.shape[0]):
+            out[i] = alpha * values[i] + (1.0 - alpha) * out[i - 1]
+        return out
+
+    @njit(cache=True, parallel=True)
+    def _true_range(high, low, close):
+        """True range per bar; the first bar has no previous close."""
+        out = np.empty_like(high)
+        out[0] = high[0] - low[0]
+        for i in prange(1, high.shape[0]):
+            out[i] = max(high[i] - low[i], abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1]))
+        return out
+
+
+def warm_numba_kernels():
+    """Compile the numba kernels into their on-disk cache (run at image build)."""
+    if not HAS_NUMBA:
+        logger.info("numba not installed; nothing to compile")
+        return
+    # Same float64 signatures the indicators dispatch with
+    values = np.ones(2, dtype=np.float64)
+    _ewm_recursive(values, 0.5)
+    _true_range(values, values, values)
+    logger.info("Compiled numba indicator kernels")
+
+
+def _use_numba(*series: pd.Series) -> bool:
+    """Whether the numba kernels apply: long, gap-free series and numba installed."""
+    return (
+        HAS_NUMBA
+        and len(series[0]) >= NUMBA_MIN_LENGTH
+        and not any(s.isna().any() for s in series)
+    )
+
+
 def calculate_ema(data: pd.Series, period: int) -> pd.Series:
     """Calculate Exponential Moving Average."""
+    if _use_numba(data):
+        values = data.to_numpy(dtype=np.float64)
+        return pd.Series(_ewm_recursive(values, 2.0 / (period + 1)), index=data.index)
     return data.ewm(span=period, adjust=False).mean()
 
 
 def calculate_atr(high: pd.Series, low: pd.Series, close: pd.Series, period: int) -> pd.Series:
-    """Calculate Average True Range."""
-    # For OHLC data, calculate true range
-    high_low = high - low
-    high_close = abs(high - close.shift(1))
-    low_close = abs(low - close.shift(1))
+    """Calculate Average True Range (Wilder's smoothing)."""
+    if _use_numba(high, low, close):
+        true_range = _true_range(
+            high.to_numpy(dtype=np.float64),
+            low.to_numpy(dtype=np.float64),
+            close.to_numpy(dtype=np.float64)
+        )
+        return pd.Series(_ewm_recursive(true_range, 1.0 / period), index=high.index)
     
-    true_range = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    atr = true_range.rolling(window=period).mean()
+    # For OHLC data, calculate true range. fmax skips the NaN previous close
+    # on the first bar, like DataFrame.max(axis=1) did.
+    h = high.to_numpy(dtype=np.float64)
+    l = low.to_numpy(dtype=np.float64)
+    prev_close = close.shift(1).to_numpy(dtype=np.float64)
+    
+    true_range = np.fmax.reduce([h - l, np.abs(h - prev_close), np.abs(l - prev_close)])
+    atr = pd.Series(true_range, index=high.index).ewm(alpha=1 / period, adjust=False).mean()
     
     return atr
 
@@ -34,95 +99,91 @@ def process_forex_data_1(interval_minutes: int, table_suffix: str):
     """
     logger.info(f"Processing Forex Data - 1 ({table_suffix} summaries)")
     
-    conn = get_db_connection(POSTGRES_DB_ANALYTICS)
-    cursor = conn.cursor()
-    
-    try:
-        table_name = f'prepared_layers.forex_ohlc_{table_suffix}'
-        
-        # Clear and recalculate for accurate indicators
-        cursor.execute(f"TRUNCATE TABLE {table_name}")
-        
-        # Get OHLC data for each pair
-        for pair_name in ['WAKMRV', 'MRVZAR']:
-            query = f"""
-                SELECT 
-                    date_trunc('hour', timestamp) + 
-                        (FLOOR(EXTRACT(MINUTE FROM timestamp) / {interval_minutes}) * INTERVAL '{interval_minutes} minutes') as datetime,
-                    pair_name,
-                    (ARRAY_AGG(bid_price ORDER BY timestamp ASC))[1] as open_price,
-                    MAX(bid_price) as high_price,
-                    MIN(bid_price) as low_price,
-                    (ARRAY_AGG(bid_price ORDER BY timestamp DESC))[1] as close_price
-                FROM forex_data.data_raw
-                WHERE pair_name = %s
-                GROUP BY datetime, pair_name
-                ORDER BY datetime
-            """
+    with db_conn(POSTGRES_DB_ANALYTICS) as conn, conn.cursor() as cursor:
+        try:
+            table_name = f'prepared_layers.forex_ohlc_{table_suffix}'
             
-            cursor.execute(query, (pair_name,))
-            data = cursor.fetchall()
+            # Clear and recalculate for accurate indicators
+            cursor.execute(f"TRUNCATE TABLE {table_name}")
             
-            if not data:
-                logger.info(f"No forex data found for {pair_name}")
-                continue
+            # Get OHLC data for each pair
+            for pair_name in ['WAKMRV', 'MRVZAR']:
+                query = f"""
+                    SELECT 
+                        date_trunc('hour', timestamp) + 
+                            (FLOOR(EXTRACT(MINUTE FROM timestamp) / {interval_minutes}) * INTERVAL '{interval_minutes} minutes') as datetime,
+                        pair_name,
+                        (ARRAY_AGG(bid_price ORDER BY timestamp ASC))[1] as open_price,
+                        MAX(bid_price) as high_price,
+                        MIN(bid_price) as low_price,
+                        (ARRAY_AGG(bid_price ORDER BY timestamp DESC))[1] as close_price
+                    FROM forex_data.data_raw
+                    WHERE pair_name = %s
+                    GROUP BY datetime, pair_name
+                    ORDER BY datetime
+                """
                 
-            df = pd.DataFrame(data, columns=['datetime', 'pair_name', 'open_price', 'high_price', 'low_price', 'close_price'])
-            
-            # Convert to float
-            df['open_price'] = df['open_price'].astype(float)
-            df['high_price'] = df['high_price'].astype(float)
-            df['low_price'] = df['low_price'].astype(float)
-            df['close_price'] = df['close_price'].astype(float)
-            
-            # Calculate EMAs on open price
-            df['ema_8'] = calculate_ema(df['open_price'], 8)
-            df['ema_21'] = calculate_ema(df['open_price'], 21)
-            
-            # Calculate ATRs
-            df['atr_8'] = calculate_atr(df['high_price'], df['low_price'], df['close_price'], 8)
-            df['atr_21'] = calculate_atr(df['high_price'], df['low_price'], df['close_price'], 21)
+                cursor.execute(query, (pair_name,))
+                data = cursor.fetchall()
+                
+                if not data:
+                    logger.info(f"No forex data found for {pair_name}")
+                    continue
+                    
+                df = pd.DataFrame(data, columns=['datetime', 'pair_name', 'open_price', 'high_price', 'low_price', 'close_price'])
+                
+                # Convert to float
+                df['open_price'] = df['open_price'].astype(float)
+                df['high_price'] = df['high_price'].astype(float)
+                df['low_price'] = df['low_price'].astype(float)
+                df['close_price'] = df['close_price'].astype(float)
+                
+                # Calculate EMAs on open price
+                df['ema_8'] = calculate_ema(df['open_price'], 8)
+                df['ema_21'] = calculate_ema(df['open_price'], 21)
+                
+                # Calculate ATRs
+                df['atr_8'] = calculate_atr(df['high_price'], df['low_price'], df['close_price'], 8)
+                df['atr_21'] = calculate_atr(df['high_price'], df['low_price'], df['close_price'], 21)
+                
+                # Insert records
+                records = []
+                for _, row in df.iterrows():
+                    records.append((
+                        row['datetime'],
+                        row['pair_name'],
+                        float(row['open_price']),
+                        float(row['high_price']),
+                        float(row['low_price']),
+                        float(row['close_price']),
+                        float(row['ema_8']) if pd.notna(row['ema_8']) else None,
+                        float(row['ema_21']) if pd.notna(row['ema_21']) else None,
+                        float(row['atr_8']) if pd.notna(row['atr_8']) else None,
+                        float(row['atr_21']) if pd.notna(row['atr_21']) else None
+                    ))
+                
+                if records:
+                    insert_query = f"""
+                        INSERT INTO {table_name} (
+                            datetime, pair_name, open_price, high_price, low_price, close_price,
+                            ema_8, ema_21, atr_8, atr_21
+                        ) VALUES %s
+                        ON CONFLICT (datetime, pair_name) DO UPDATE SET
+                            open_price = EXCLUDED.open_price,
+                            high_price = EXCLUDED.high_price,
+                            low_price = EXCLUDED.low_price,
+                            close_price = EXCLUDED.close_price,
+                            ema_8 = EXCLUDED.ema_8,
+                            ema_21 = EXCLUDED.ema_21,
+                            atr_8 = EXCLUDED.atr_8,
+                            atr_21 = EXCLUDED.atr_21
+                    """
+                    ensure_monthly_partitions(cursor, table_name, df['datetime'].min(), df['datetime'].max())
+                    execute_values(cursor, insert_query, records, page_size=EXECUTE_VALUES_PAGE_SIZE)
+                    logger.info(f"Inserted {len(records)} {table_suffix} records for {pair_name}")
             
-            # Insert records
-            records = []
-            for _, row in df.iterrows():
-                records.append((
-                    row['datetime'],
-                    row['pair_name'],
-                    float(row['open_price']),
-                    float(row['high_price']),
-                    float(row['low_price']),
-                    float(row['close_price']),
-                    float(row['ema_8']) if pd.notna(row['ema_8']) else None,
-                    float(row['ema_21']) if pd.notna(row['ema_21']) else None,
-                    float(row['atr_8']) if pd.notna(row['atr_8']) else None,
-                    float(row['atr_21']) if pd.notna(row['atr_21']) else None
-                ))
+            conn.commit()
             
-            if records:
-                insert_query = f"""
-                    INSERT INTO {table_name} (
-                        datetime, pair_name, open_price, high_price, low_price, close_price,
-                        ema_8, ema_21, atr_8, atr_21
-                    ) VALUES %s
-                    ON CONFLICT (datetime, pair_name) DO UPDATE SET
-                        open_price = EXCLUDED.open_price,
-                        high_price = EXCLUDED.high_price,
-                        low_price = EXCLUDED.low_price,
-                        close_price = EXCLUDED.close_price,
-                        ema_8 = EXCLUDED.ema_8,
-                        ema_21 = EXCLUDED.ema_21,
-                        atr_8 = EXCLUDED.atr_8,
-                        atr_21 = EXCLUDED.atr_21
-                """
-                execute_values(cursor, insert_query, records)
-                logger.info(f"Inserted {len(records)} {table_suffix} records for {pair_name}")
-        
-        conn.commit()
-        
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error processing Forex Data - 1 ({table_suffix}): {e}")
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error processing Forex Data - 1 ({table_suffix}): {e}")
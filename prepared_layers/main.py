@@ -12,7 +12,7 @@ Forex Data - 1: Forex OHLC summaries enriched with technical indicators.
 import time
 import schedule
 from prepared_layers.utils import get_logger, setup_logging, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB_ANALYTICS, POSTGRES_DB_PROD
-from prepared_layers.database import create_prepared_layer_tables
+from prepared_layers.database import create_prepared_layer_tables, setup_crm_foreign_tables
 from prepared_layers.layers.cdr import process_cdr_data_1, process_cdr_data_2
 from prepared_layers.layers.crm import process_crm_data_1
 from prepared_layers.layers.forex import process_forex_data_1
@@ -20,6 +20,9 @@ from prepared_layers.layers.forex import process_forex_data_1
 
 logger = get_logger(__name__)
 
+# Whether the prod CRM foreign tables are set up; retried each run until they are
+crm_ready = False
+
 def run_layer(layer_name, func, *args):
     """Run a layer function and handle errors."""
     logger.info(f"Starting {layer_name}...")
@@ -38,6 +41,7 @@ def run_layer(layer_name, func, *args):
 
 def run_all_processing():
     """Run all prepared layer processing jobs."""
+    global crm_ready
     logger.info("=" * 60)
     logger.info("Starting Prepared Layers")
     logger.info("=" * 60)
@@ -45,7 +49,12 @@ def run_all_processing():
     start_time = time.time()
 
     # CRM Data - 1: Flattened CRM with balance
-    run_layer('CRM_Flattened', process_crm_data_1)
+    if not crm_ready:
+        crm_ready = setup_crm_foreign_tables()
+    if crm_ready:
+        run_layer('CRM_Flattened', process_crm_data_1)
+    else:
+        logger.warning("Skipping CRM_Flattened: prod CRM foreign tables unavailable")
 
     # CDR Data - 1: Time-based summaries
     run_layer('CDR_15min', process_cdr_data_1, 15, '15min')
@@ -10,6 +10,14 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'postgres')
 POSTGRES_DB_ANALYTICS = os.getenv('POSTGRES_DB_ANALYTICS', 'wtc_analytics')
 POSTGRES_DB_PROD = os.getenv('POSTGRES_DB_PROD', 'wtc_prod')
 
+# How the analytics server reaches the prod database through postgres_fdw.
+# Both databases live on the same cluster, so this is local to the server.
+POSTGRES_FDW_HOST = os.getenv('POSTGRES_FDW_HOST', 'localhost')
+POSTGRES_FDW_PORT = int(os.getenv('POSTGRES_FDW_PORT', 5432))
+
+# Rows per multi-row INSERT statement sent by execute_values
+EXECUTE_VALUES_PAGE_SIZE = int(os.getenv('EXECUTE_VALUES_PAGE_SIZE', 10000))
+
 # Constants for WAK (pricing)
 CALL_RATE_ZAR_PER_MINUTE = 1.0  
 DATA_RATE_ZAR_PER_GB = 49.0     
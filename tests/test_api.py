@@ -95,10 +95,12 @@ class TestDatabaseQuery(unittest.TestCase):
 
 class TestFlaskRoutes(unittest.TestCase):
 
-    def setUp(self):
-        app = get_app()
-        app.config["TESTING"] = True
-        self.client = app.test_client()
+    @classmethod
+    def setUpClass(cls):
+        # Build the app once per class; test clients don't share state
+        cls.app = get_app()
+        cls.app.config["TESTING"] = True
+        cls.client = cls.app.test_client()
 
     @patch("cdr_usage_api.main.get_db_connection")
     def test_health(self, mock_conn):
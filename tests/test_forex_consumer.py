@@ -1,34 +1,45 @@
+import importlib
 import sys
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 import datetime
 
-sys.modules['kafka'] = MagicMock()
-sys.modules['kafka.KafkaConsumer'] = MagicMock()
-sys.modules['sqlalchemy'] = MagicMock()
-sys.modules['sqlalchemy.create_engine'] = MagicMock()
-sys.modules['sqlalchemy.orm'] = MagicMock()
+class TestForexConsumer(unittest.TestCase):
 
-import forex_consumer.forex_consumer as fc
+    @classmethod
+    def setUpClass(cls):
+        # Stub kafka/sqlalchemy only for this class so the stubs don't leak
+        # into other test modules in the same process
+        cls._modules_patcher = patch.dict(sys.modules, {
+            'kafka': MagicMock(),
+            'sqlalchemy': MagicMock(),
+            'sqlalchemy.orm': MagicMock(),
+        })
+        cls._modules_patcher.start()
+        cls.fc = importlib.import_module('forex_consumer.forex_consumer')
 
-class TestForexConsumer(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        cls._modules_patcher.stop()
 
     def test_insert_batch_empty(self):
         """insert_batch should do nothing if batch is empty"""
         mock_session = MagicMock()
-        fc.insert_batch(mock_session, [])
+        self.fc.insert_batch(mock_session, [])
         mock_session.execute.assert_not_called()
         mock_session.commit.assert_not_called()
 
     def test_insert_batch_nonempty(self):
-        """insert_batch should execute insert for each tick"""
+        """insert_batch should insert the whole batch in a single execute"""
         mock_session = MagicMock()
         batch = [
             {"timestamp": datetime.datetime(2025,12,7,12,0), "pair_name":"WAKMRV", "bid_price":100.0, "ask_price":101.0, "spread":1.0},
             {"timestamp": datetime.datetime(2025,12,7,12,1), "pair_name":"MRVZAR", "bid_price":200.0, "ask_price":201.0, "spread":1.0}
         ]
-        fc.insert_batch(mock_session, batch)
-        self.assertEqual(mock_session.execute.call_count, 2)
+        self.fc.insert_batch(mock_session, batch)
+        self.assertEqual(mock_session.execute.call_count, 1)
+        self.assertIs(mock_session.execute.call_args.args[0], self.fc.INSERT_TICK)
+        self.assertEqual(mock_session.execute.call_args.args[1], batch)
         mock_session.commit.assert_called_once()
 
 if __name__ == "__main__":
@@ -1,31 +1,39 @@
-import sys, datetime
-from unittest.mock import MagicMock
-
-# Mock kafka, cassandra, prometheus_client so they do not actually load
-sys.modules['kafka'] = MagicMock()
-sys.modules['kafka.KafkaConsumer'] = MagicMock()
-sys.modules['cassandra'] = MagicMock()
-sys.modules['cassandra.cluster'] = MagicMock()
-sys.modules['prometheus_client'] = MagicMock()
-
-import hvs.consumer as consumer
+import sys, datetime, importlib
+from unittest.mock import MagicMock, patch
 
 import unittest
 
 class TestConsumerHelpers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Mock kafka, cassandra, prometheus_client so they do not actually load,
+        # scoped to this class so the stubs don't leak into other test modules
+        cls._modules_patcher = patch.dict(sys.modules, {
+            'kafka': MagicMock(),
+            'cassandra': MagicMock(),
+            'cassandra.cluster': MagicMock(),
+            'prometheus_client': MagicMock(),
+        })
+        cls._modules_patcher.start()
+        cls.consumer = importlib.import_module('hvs.consumer')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._modules_patcher.stop()
+
     def test_to_usage_date(self):
         ts = "2025-12-07T12:34:56Z"
-        date = consumer.to_usage_date(ts)
+        date = self.consumer.to_usage_date(ts)
         self.assertEqual(date, datetime.date(2025,12,7))
 
     def test_data_cost_wak(self):
-        cost = consumer.data_cost_wak(1000000000)
-        expected = int(round(49.0 * consumer.WAK_PER_ZAR))
+        cost = self.consumer.data_cost_wak(1000000000)
+        expected = int(round(49.0 * self.consumer.WAK_PER_ZAR))
         self.assertEqual(cost, expected)
 
     def test_voice_cost_wak(self):
-        cost = consumer.voice_cost_wak(60)
-        expected = int(round(1 * consumer.WAK_PER_ZAR))
+        cost = self.consumer.voice_cost_wak(60)
+        expected = int(round(1 * self.consumer.WAK_PER_ZAR))
         self.assertEqual(cost, expected)
 
 if __name__ == "__main__":
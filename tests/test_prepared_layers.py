@@ -1,125 +1,43 @@
+import re
 import unittest
 from unittest.mock import patch, MagicMock
+import numpy as np
 import pandas as pd
-from prepared_layers.layers.cdr import process_cdr_data_2
-from prepared_layers.layers.crm import process_crm_data_1
+import psycopg2
+from prepared_layers.layers.cdr import process_cdr_data_1, process_cdr_data_2
+from prepared_layers.layers.crm import process_crm_data_1, update_crm_balances_from_cdr
+from prepared_layers import main
+from prepared_layers.layers import forex
 from prepared_layers.layers.forex import process_forex_data_1, calculate_ema, calculate_atr
+from prepared_layers.database import get_db_connection, ensure_monthly_partitions, setup_crm_foreign_tables, _rename_unpartitioned, _drop_stale_crm_table
+from prepared_layers.utils import EXECUTE_VALUES_PAGE_SIZE
 
-class TestPreparedLayers(unittest.TestCase):
 
-    # ------------------ CDR Data - 2 ------------------
-    @patch("prepared_layers.layers.cdr.get_db_connection")
-    @patch("prepared_layers.layers.cdr.execute_values")
-    def test_cdr_data_2_session_detection(self, mock_execute_values, mock_get_conn):
-        """Test CDR Data - 2: tower session processing."""
-        mock_cursor = MagicMock()
-        mock_conn = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_get_conn.return_value = mock_conn
+def _norm_sql(sql):
+    """Collapse whitespace so SQL assertions don't depend on formatting."""
+    return re.sub(r"\s+", " ", sql).strip()
 
-        # Simulate no sessions found
-        mock_cursor.fetchall.return_value = []
-
-        process_cdr_data_2()
 
-        mock_cursor.execute.assert_any_call("TRUNCATE TABLE prepared_layers.cdr_tower_sessions")
-        mock_conn.commit.assert_called()
+class TestPreparedLayers(unittest.TestCase):
 
-    # ------------------ CRM Data - 1 ------------------
-    @patch("prepared_layers.layers.crm.get_db_connection")
-    @patch("prepared_layers.layers.crm.execute_values")
-    @patch("pandas.read_sql")
-    def test_crm_data_1_flatten_and_balance(self, mock_read_sql, mock_execute_values, mock_get_conn):
-        """Test CRM Data - 1: flattened table creation and balance calculation."""
-        mock_cursor = MagicMock()
-        mock_conn_prod = MagicMock()
-        mock_conn_analytics = MagicMock()
-        mock_conn_analytics.cursor.return_value = mock_cursor
-        mock_get_conn.side_effect = [mock_conn_prod, mock_conn_analytics]
-
-        # Dummy CRM data
-        mock_read_sql.return_value = pd.DataFrame({
-            "account_id": [1],
-            "owner_name": ["John Doe"],
-            "email": ["john@example.com"],
-            "msisdn": ["27820000001"],
-            "device_id": [101],
-            "device_name": ["iPhone"],
-            "device_type": ["Mobile"],
-            "device_os": ["iOS"],
-            "street_address": ["123 Main St"],
-            "city": ["Cape Town"],
-            "state": ["Western Cape"],
-            "postal_code": ["8000"],
-            "country": ["South Africa"],
-            "last_modified": [pd.Timestamp.now()]
+    @classmethod
+    def setUpClass(cls):
+        # Input frames are only read by the tests, so build them once
+        cls.ohlc_df = pd.DataFrame({
+            "open": [1,2,3,4,5,6,7,8],
+            "high": [1,2,3,4,5,6,7,8],
+            "low": [0,1,2,3,4,5,6,7],
+            "close": [1,2,3,4,5,6,7,8]
         })
 
-        process_crm_data_1()
-
-        # Check table creation and commit
-        mock_cursor.execute.assert_any_call(
-            """\n        DROP TABLE IF EXISTS prepared_layers.crm_flattened_balance CASCADE;\n        \n        CREATE TABLE prepared_layers.crm_flattened_balance (
-            account_id INTEGER,
-            owner_name VARCHAR(255),
-            email VARCHAR(255),
-            msisdn VARCHAR(20),
-            device_id INTEGER,
-            device_name VARCHAR(255),
-            device_type VARCHAR(50),
-            device_os VARCHAR(50),
-            street_address VARCHAR(500),
-            city VARCHAR(100),
-            state VARCHAR(50),
-            postal_code VARCHAR(20),
-            country VARCHAR(50),
-            last_modified TIMESTAMP,
-            total_data_bytes BIGINT DEFAULT 0,
-            data_cost_zar DECIMAL(10,2) DEFAULT 0,
-            total_call_seconds INTEGER DEFAULT 0,
-            voice_cost_zar DECIMAL(10,2) DEFAULT 0,
-            total_cost_zar DECIMAL(10,2) DEFAULT 0,
-            running_balance_zar DECIMAL(10,2) DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (account_id, device_id)
-        );
-        \n        CREATE INDEX idx_crm_flattened_msisdn ON prepared_layers.crm_flattened_balance(msisdn);
-        CREATE INDEX idx_crm_flattened_account ON prepared_layers.crm_flattened_balance(account_id);
-        """
-        )
-        mock_conn_analytics.commit.assert_called()
-
-    # ------------------ Forex Data - 1 ------------------
-    # def test_forex_data_1_ema_atr(self):
-    #     """Test Forex Data - 1: EMA and ATR calculations."""
-    #     df = pd.DataFrame({
-    #         "open": [1,2,3,4,5,6,7,8],
-    #         "high": [1,2,3,4,5,6,7,8],
-    #         "low": [0,1,2,3,4,5,6,7],
-    #         "close": [1,2,3,4,5,6,7,8]
-    #     })
-
-    #     ema8 = calculate_ema(df['open'], 8)
-    #     ema21 = calculate_ema(df['open'], 21)
-    #     atr8 = calculate_atr(df['high'], df['low'], df['close'], 8)
-    #     atr21 = calculate_atr(df['high'], df['low'], df['close'], 21)
-
-    #     self.assertEqual(len(ema8), len(df))
-    #     self.assertEqual(len(atr21), len(df))
-    #     self.assertGreater(ema8.iloc[-1], 0)
-    #     self.assertGreaterEqual(atr21.iloc[-1], 0)
-
-    # ------------------ CDR Data - 1 (merge check) ------------------
-    def test_cdr_data_1_merge_and_columns(self):
-        """Test CDR Data - 1: merge voice and data usage and column check."""
-        voice_df = pd.DataFrame({
+        cls.voice_df = pd.DataFrame({
             "datetime": ["2025-12-07 12:00:00"],
             "msisdn": ["27820000001"],
             "voice_call_count": [2],
             "video_call_count": [1],
             "total_call_duration_sec": [120]
         })
-        data_df = pd.DataFrame({
+        cls.data_df = pd.DataFrame({
             "datetime": ["2025-12-07 12:00:00"],
             "msisdn": ["27820000001"],
             "video_up": [1000],
@@ -136,7 +54,176 @@ class TestPreparedLayers(unittest.TestCase):
             "total_down": [1200]
         })
 
-        merged_df = pd.merge(voice_df, data_df, on=["datetime","msisdn"], how="outer").fillna(0)
+    def assertSqlIn(self, fragment, sql):
+        self.assertIn(_norm_sql(fragment), _norm_sql(sql))
+
+    # ------------------ CDR Data - 1 ------------------
+    @patch("prepared_layers.layers.cdr.db_conn")
+    @patch("prepared_layers.layers.cdr.execute_values")
+    def test_cdr_data_1_batched_insert(self, mock_execute_values, mock_db_conn):
+        """Test CDR Data - 1: merged summaries are written in one batched insert."""
+        bucket = pd.Timestamp("2025-12-07 12:00:00").to_pydatetime()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (pd.Timestamp("1970-01-01").to_pydatetime(),)
+        mock_cursor.fetchall.side_effect = [
+            [(bucket, "27820000001", 2, 1, 120)],
+            [(bucket, "27820000001", 1000, 800, 500, 400, 0, 0, 0, 0, 0, 0, 1500, 1200),
+             (bucket, "27820000002", 10, 20, 0, 0, 0, 0, 0, 0, 0, 0, 10, 20)],
+            [],  # no existing partitions
+        ]
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_db_conn.return_value.__enter__.return_value = mock_conn
+
+        process_cdr_data_1(60, "1hr")
+
+        mock_execute_values.assert_called_once()
+        records = mock_execute_values.call_args.args[2]
+        self.assertEqual(len(records), 2)
+        self.assertEqual({r[1] for r in records}, {"27820000001", "27820000002"})
+        self.assertEqual(records[0][2:5], (2, 1, 120))
+        self.assertEqual(mock_execute_values.call_args.kwargs["page_size"], EXECUTE_VALUES_PAGE_SIZE)
+        mock_conn.commit.assert_called_once()
+
+    # ------------------ CDR Data - 2 ------------------
+    @patch("prepared_layers.layers.cdr.db_conn")
+    @patch("prepared_layers.layers.cdr.execute_values")
+    def test_cdr_data_2_session_detection(self, mock_execute_values, mock_db_conn):
+        """Test CDR Data - 2: tower session processing."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_db_conn.return_value.__enter__.return_value = mock_conn
+
+        # Simulate no sessions found
+        mock_cursor.rowcount = 0
+
+        process_cdr_data_2()
+
+        truncate_sql = mock_cursor.execute.call_args_list[0].args[0]
+        self.assertSqlIn("TRUNCATE TABLE prepared_layers.cdr_tower_sessions", truncate_sql)
+        # Sessions are detected and inserted server-side; nothing is fetched
+        session_sql = mock_cursor.execute.call_args_list[1].args[0]
+        self.assertSqlIn("INSERT INTO prepared_layers.cdr_tower_sessions", session_sql)
+        self.assertSqlIn("HAVING COUNT(*) > 2", session_sql)
+        mock_cursor.fetchall.assert_not_called()
+        mock_execute_values.assert_not_called()
+        mock_conn.commit.assert_called()
+
+    # ------------------ CRM Data - 1 ------------------
+    @patch("prepared_layers.layers.crm.db_conn")
+    def test_crm_data_1_flatten_and_balance(self, mock_db_conn):
+        """Test CRM Data - 1: incremental upsert of changed CRM records."""
+        last_processed = pd.Timestamp("2025-12-07 12:00:00")
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (last_processed,)
+        mock_cursor.rowcount = 1
+        mock_conn_analytics = MagicMock()
+        mock_conn_analytics.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_db_conn.return_value.__enter__.return_value = mock_conn_analytics
+
+        process_crm_data_1()
+
+        # Changed rows are upserted from the prod foreign tables past the watermark
+        upsert_sql, upsert_params = mock_cursor.execute.call_args_list[1].args
+        self.assertSqlIn("INSERT INTO prepared_layers.crm_flattened_balance", upsert_sql)
+        self.assertSqlIn("FROM crm_fdw.accounts a", upsert_sql)
+        self.assertSqlIn("ON CONFLICT (account_id, device_id)", upsert_sql)
+        self.assertEqual(upsert_params, (last_processed,))
+
+        # Watermark is advanced and committed
+        state_sql = mock_cursor.execute.call_args_list[2].args[0]
+        self.assertSqlIn("INSERT INTO prepared_layers.processing_state", state_sql)
+
+        # Rows deleted in prod are removed in the same transaction
+        delete_sql = mock_cursor.execute.call_args_list[3].args[0]
+        self.assertSqlIn("DELETE FROM prepared_layers.crm_flattened_balance f WHERE NOT EXISTS", delete_sql)
+        mock_conn_analytics.commit.assert_called_once()
+        # The cursor is closed before the connection goes back to the pool
+        mock_conn_analytics.cursor.return_value.__exit__.assert_called_once()
+
+    @patch("prepared_layers.layers.crm.db_conn")
+    def test_crm_balances_from_cdr_totals(self, mock_db_conn):
+        """CRM balances are refreshed from per-msisdn totals past the watermark."""
+        last_processed = pd.Timestamp("2025-12-07 12:00:00")
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (last_processed,)
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_db_conn.return_value.__enter__.return_value = mock_conn
+
+        update_crm_balances_from_cdr()
+
+        calls = mock_cursor.execute.call_args_list
+        # Totals are re-summed for msisdns with hourly summaries since the watermark
+        totals_sql, totals_params = calls[1].args
+        self.assertSqlIn("INSERT INTO prepared_layers.cdr_msisdn_totals", totals_sql)
+        self.assertSqlIn("FROM prepared_layers.cdr_usage_summary_1hr", totals_sql)
+        self.assertSqlIn("WHERE datetime >= %s", totals_sql)
+        self.assertEqual(totals_params, (last_processed,))
+
+        # The totals watermark is advanced
+        state_sql, state_params = calls[2].args
+        self.assertSqlIn("INSERT INTO prepared_layers.processing_state", state_sql)
+        self.assertSqlIn("ON CONFLICT (layer_name) DO UPDATE", state_sql)
+        self.assertEqual(state_params, ("cdr_msisdn_totals",))
+
+        # Balances are joined to the totals, skipping unchanged rows
+        update_sql = calls[3].args[0]
+        self.assertSqlIn("UPDATE prepared_layers.crm_flattened_balance crm", update_sql)
+        self.assertSqlIn("FROM prepared_layers.cdr_msisdn_totals t", update_sql)
+        self.assertSqlIn("IS DISTINCT FROM", update_sql)
+        mock_conn.commit.assert_called_once()
+
+        # Costs are derived by generated columns, so one UPDATE writes the
+        # base columns only
+        updates = [c.args[0] for c in calls if _norm_sql(c.args[0]).startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn("total_cost_zar", update_sql)
+
+    # ------------------ Forex Data - 1 ------------------
+    def test_forex_data_1_ema_atr(self):
+        """Test Forex Data - 1: EMA and ATR calculations."""
+        df = self.ohlc_df
+
+        ema8 = calculate_ema(df['open'], 8)
+        ema21 = calculate_ema(df['open'], 21)
+        atr8 = calculate_atr(df['high'], df['low'], df['close'], 8)
+        atr21 = calculate_atr(df['high'], df['low'], df['close'], 21)
+
+        self.assertEqual(len(ema8), len(df))
+        self.assertEqual(len(atr21), len(df))
+        self.assertGreater(ema8.iloc[-1], 0)
+        self.assertGreaterEqual(atr21.iloc[-1], 0)
+        # True range is 1 on every bar, so Wilder's ATR is flat at 1
+        self.assertAlmostEqual(atr8.iloc[-1], 1.0)
+
+    @unittest.skipUnless(forex.HAS_NUMBA, "numba not installed")
+    def test_forex_numba_kernels_match_pandas(self):
+        """The numba EMA/ATR kernels reproduce the pandas indicators."""
+        rng = np.random.default_rng(0)
+        close = pd.Series(100 + rng.standard_normal(500).cumsum())
+        high = close + rng.random(500)
+        low = close - rng.random(500)
+
+        with patch.object(forex, "HAS_NUMBA", False):
+            expected_ema = calculate_ema(close, 21)
+            expected_atr = calculate_atr(high, low, close, 14)
+
+        with patch.object(forex, "NUMBA_MIN_LENGTH", 10), \
+                patch.object(forex, "_ewm_recursive", wraps=forex._ewm_recursive) as kernel:
+            ema = calculate_ema(close, 21)
+            atr = calculate_atr(high, low, close, 14)
+
+        self.assertEqual(kernel.call_count, 2)
+        pd.testing.assert_series_equal(ema, expected_ema)
+        pd.testing.assert_series_equal(atr, expected_atr)
+
+    # ------------------ CDR Data - 1 (merge check) ------------------
+    def test_cdr_data_1_merge_and_columns(self):
+        """Test CDR Data - 1: merge voice and data usage and column check."""
+        keys = ["datetime", "msisdn"]
+        merged_df = self.voice_df.set_index(keys).join(self.data_df.set_index(keys), how="outer").fillna(0).reset_index()
 
         required_columns = [
             "datetime","msisdn","voice_call_count","video_call_count","total_call_duration_sec",
@@ -148,5 +235,157 @@ class TestPreparedLayers(unittest.TestCase):
         self.assertEqual(merged_df["voice_call_count"].iloc[0], 2)
         self.assertEqual(merged_df["video_up"].iloc[0], 1000)
 
+    # ------------------ Connection pool ------------------
+    @patch("prepared_layers.database._get_pool")
+    def test_dead_pooled_connection_is_replaced(self, mock_get_pool):
+        """A pooled connection dropped server-side is discarded on checkout."""
+        dead_conn = MagicMock(closed=0)
+        dead_conn.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.OperationalError("server closed the connection unexpectedly")
+        fresh_conn = MagicMock(closed=0)
+        pool = mock_get_pool.return_value
+        pool.getconn.side_effect = [dead_conn, fresh_conn]
+
+        self.assertIs(get_db_connection("wtc_analytics"), fresh_conn)
+        pool.putconn.assert_called_once_with(dead_conn, close=True)
+
+    # ------------------ Partition maintenance ------------------
+    def test_ensure_monthly_partitions_spans_year_end(self):
+        """Only the missing monthly partitions in the range are created, in one statement."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [("cdr_usage_summary_1hr_2025_11",)]
+
+        ensure_monthly_partitions(
+            mock_cursor, "prepared_layers.cdr_usage_summary_1hr",
+            pd.Timestamp("2025-11-15 10:00:00"), pd.Timestamp("2026-01-02 08:00:00")
+        )
+
+        calls = mock_cursor.execute.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertSqlIn("FROM pg_inherits", calls[0].args[0])
+        self.assertEqual(calls[0].args[1], ("prepared_layers.cdr_usage_summary_1hr",))
+
+        create_sql, params = calls[1].args
+        self.assertNotIn("_2025_11", create_sql)
+        self.assertIn("prepared_layers.cdr_usage_summary_1hr_2025_12", create_sql)
+        self.assertIn("prepared_layers.cdr_usage_summary_1hr_2026_01", create_sql)
+        self.assertEqual(
+            [str(d) for d in params],
+            ["2025-12-01", "2026-01-01", "2026-01-01", "2026-02-01"]
+        )
+
+    def test_ensure_monthly_partitions_all_present(self):
+        """Nothing is sent beyond the lookup when every partition exists."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            ("forex_ohlc_m1_2025_11",), ("forex_ohlc_m1_2025_12",)
+        ]
+
+        ensure_monthly_partitions(
+            mock_cursor, "prepared_layers.forex_ohlc_m1",
+            pd.Timestamp("2025-11-01 00:00:00"), pd.Timestamp("2025-12-31 23:59:00")
+        )
+
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+
+    def test_unpartitioned_table_is_renamed_aside(self):
+        """A pre-partitioning heap and its indexes are renamed to *_old."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = ("r",)
+        mock_cursor.fetchall.return_value = [("forex_ohlc_m1_pkey",), ("idx_forex_m1_pair",)]
+
+        self.assertTrue(_rename_unpartitioned(mock_cursor, "forex_ohlc_m1"))
+
+        statements = [c.args[0] for c in mock_cursor.execute.call_args_list[2:]]
+        self.assertEqual(statements, [
+            "ALTER INDEX prepared_layers.forex_ohlc_m1_pkey RENAME TO forex_ohlc_m1_pkey_old",
+            "ALTER INDEX prepared_layers.idx_forex_m1_pair RENAME TO idx_forex_m1_pair_old",
+            "ALTER TABLE prepared_layers.forex_ohlc_m1 RENAME TO forex_ohlc_m1_old",
+        ])
+
+    def test_partitioned_table_is_left_alone(self):
+        """Already partitioned tables are not migrated again."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = ("p",)
+
+        self.assertFalse(_rename_unpartitioned(mock_cursor, "forex_ohlc_m1"))
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+
+    def test_stale_crm_table_is_dropped(self):
+        """A crm_flattened_balance with plain cost columns is dropped for rebuild."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = ("",)
+
+        self.assertTrue(_drop_stale_crm_table(mock_cursor))
+        mock_cursor.execute.assert_called_with("DROP TABLE prepared_layers.crm_flattened_balance")
+
+    def test_generated_crm_table_is_kept(self):
+        """A crm_flattened_balance with generated cost columns is kept."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = ("s",)
+
+        self.assertFalse(_drop_stale_crm_table(mock_cursor))
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+
+    # ------------------ CRM foreign tables ------------------
+    @patch.object(main, "crm_ready", False)
+    @patch("prepared_layers.main.run_layer")
+    @patch("prepared_layers.main.setup_crm_foreign_tables")
+    def test_failed_crm_setup_is_retried_next_run(self, mock_setup, mock_run_layer):
+        """CRM Data - 1 is skipped after a failed fdw setup and retried on the next run."""
+        mock_setup.side_effect = [False, True]
+
+        main.run_all_processing()
+        layers = [c.args[0] for c in mock_run_layer.call_args_list]
+        self.assertNotIn("CRM_Flattened", layers)
+        self.assertIn("CDR_1hr", layers)
+
+        mock_run_layer.reset_mock()
+        main.run_all_processing()
+        layers = [c.args[0] for c in mock_run_layer.call_args_list]
+        self.assertIn("CRM_Flattened", layers)
+
+        # Set up once it succeeds, not on every run
+        main.run_all_processing()
+        self.assertEqual(mock_setup.call_count, 2)
+
+    @patch("prepared_layers.database.release_db_connection")
+    @patch("prepared_layers.database.get_db_connection")
+    def test_crm_foreign_tables_altered_in_place(self, mock_get_conn, mock_release):
+        """An existing fdw server is altered, and only missing tables are imported."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (["host=old", "port=5432", "dbname=prod"],)
+        mock_cursor.fetchall.return_value = [("accounts",), ("devices",)]
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        self.assertTrue(setup_crm_foreign_tables())
+
+        statements = [_norm_sql(c.args[0]) for c in mock_cursor.execute.call_args_list]
+        self.assertFalse(any("DROP SERVER" in sql or "CREATE SERVER" in sql for sql in statements))
+        self.assertIn(
+            "ALTER SERVER prod_server OPTIONS (SET host %s, SET port %s, SET dbname %s, ADD fetch_size %s)",
+            statements
+        )
+        imports = [sql for sql in statements if sql.startswith("IMPORT FOREIGN SCHEMA")]
+        self.assertEqual(len(imports), 1)
+        self.assertIn("LIMIT TO (addresses)", imports[0])
+        mock_conn.commit.assert_called_once()
+
+    @patch("prepared_layers.database.release_db_connection")
+    @patch("prepared_layers.database.get_db_connection")
+    def test_crm_foreign_tables_failure_is_contained(self, mock_get_conn, mock_release):
+        """An unreachable prod database disables CRM instead of raising."""
+        mock_cursor = MagicMock()
+        mock_cursor.execute.side_effect = Exception("could not connect to server")
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        self.assertFalse(setup_crm_foreign_tables())
+        mock_conn.rollback.assert_called_once()
+        mock_release.assert_called_once()
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,139 @@
+import functools
+import gzip
+import http.client
+import http.server
+import importlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+proxy = importlib.import_module("web_app.proxy")
+
+
+class QuietHandler(proxy.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TestStaticFiles(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Serve a scratch directory over a real socket
+        cls.root = tempfile.mkdtemp()
+        cls.app_js = b"console.log('prepared layers');\n" * 50
+        with open(os.path.join(cls.root, "app.js"), "wb") as f:
+            f.write(cls.app_js)
+        cls.logo_png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 512
+        with open(os.path.join(cls.root, "logo.png"), "wb") as f:
+            f.write(cls.logo_png)
+        os.mkdir(os.path.join(cls.root, "sub"))
+        with open(os.path.join(cls.root, "sub", "index.html"), "wb") as f:
+            f.write(b"<html>sub</html>")
+
+        handler = functools.partial(QuietHandler, directory=cls.root)
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root)
+
+    def get(self, path, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server.server_port, timeout=5)
+        try:
+            conn.request("GET", path, headers=headers or {})
+            resp = conn.getresponse()
+            return resp, resp.read()
+        finally:
+            conn.close()
+
+    def test_gzip_negotiation(self):
+        """Text assets are gzipped only when the client accepts it."""
+        resp, body = self.get("/app.js")
+        self.assertEqual(resp.status, 200)
+        self.assertIsNone(resp.getheader("Content-Encoding"))
+        self.assertEqual(body, self.app_js)
+
+        gz_resp, gz_body = self.get("/app.js", {"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(gz_resp.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(gzip.decompress(gz_body), self.app_js)
+        self.assertLess(len(gz_body), len(self.app_js))
+        # Each encoding is a separate representation
+        self.assertNotEqual(resp.getheader("ETag"), gz_resp.getheader("ETag"))
+
+    def test_gzip_refused_with_zero_qvalue(self):
+        """gzip;q=0 opts out of gzip, as does a wildcard refusal."""
+        for header in ("gzip;q=0", "deflate, gzip; q=0.0", "*;q=0", "identity"):
+            resp, body = self.get("/app.js", {"Accept-Encoding": header})
+            self.assertIsNone(resp.getheader("Content-Encoding"), header)
+            self.assertEqual(body, self.app_js)
+
+        for header in ("gzip;q=0.5", "*", "br, *;q=0.1"):
+            resp, _ = self.get("/app.js", {"Accept-Encoding": header})
+            self.assertEqual(resp.getheader("Content-Encoding"), "gzip", header)
+
+    def test_binary_files_are_not_compressed(self):
+        """Non-text types are served as-is and never gzipped into the cache."""
+        proxy.load_static.cache_clear()
+        resp, body = self.get("/logo.png", {"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status, 200)
+        self.assertIsNone(resp.getheader("Content-Encoding"))
+        self.assertEqual(body, self.logo_png)
+
+        path = os.path.join(self.root, "logo.png")
+        _, gz, _ = proxy.load_static(path, os.stat(path).st_mtime_ns, False)
+        self.assertIsNone(gz)
+        self.assertEqual(proxy.load_static.cache_info().hits, 1)
+
+    def test_matching_etag_is_not_modified(self):
+        """A matching If-None-Match gets a bodyless 304."""
+        resp, _ = self.get("/app.js")
+        etag = resp.getheader("ETag")
+
+        resp, body = self.get("/app.js", {"If-None-Match": etag})
+        self.assertEqual(resp.status, 304)
+        self.assertEqual(body, b"")
+
+        resp, _ = self.get("/app.js", {"If-None-Match": '"stale"'})
+        self.assertEqual(resp.status, 200)
+
+    def test_if_modified_since(self):
+        """If-Modified-Since at or after Last-Modified gets a 304."""
+        resp, _ = self.get("/app.js")
+        last_modified = resp.getheader("Last-Modified")
+
+        resp, body = self.get("/app.js", {"If-Modified-Since": last_modified})
+        self.assertEqual(resp.status, 304)
+        self.assertEqual(body, b"")
+
+        resp, _ = self.get("/app.js", {"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+        self.assertEqual(resp.status, 200)
+
+    def test_directories_use_stock_handler(self):
+        """Directories keep the stock redirect and index.html behaviour."""
+        resp, _ = self.get("/sub")
+        self.assertEqual(resp.status, 301)
+
+        resp, body = self.get("/sub/")
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, b"<html>sub</html>")
+        self.assertIsNone(resp.getheader("ETag"))
+
+    def test_large_files_use_stock_handler(self):
+        """Files over the cache limit are sent uncached."""
+        with patch.object(proxy, "STATIC_CACHE_MAX_BYTES", 16):
+            resp, body = self.get("/app.js", {"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, self.app_js)
+        self.assertIsNone(resp.getheader("ETag"))
+        self.assertIsNone(resp.getheader("Content-Encoding"))
+
+
+if __name__ == "__main__":
+    unittest.main()
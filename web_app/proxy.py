@@ -4,51 +4,206 @@
 Run: python web_app/proxy.py
 Open: http://localhost:8000
 """
+import datetime
+import email.utils
+import functools
+import gzip
+import http.client
 import http.server
-import socketserver
-import urllib.request
-import urllib.error
+import io
+import shutil
+import stat
+import threading
 import urllib.parse
 import os
 
 PORT = 8000
 BACKEND = os.environ.get('USAGE_API_BACKEND', 'http://localhost:5000')
+BACKEND_URL = urllib.parse.urlsplit(BACKEND)
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = ('transfer-encoding', 'connection', 'keep-alive')
+
+# Static files up to this size are kept in memory along with a gzipped copy
+STATIC_CACHE_MAX_BYTES = 1 << 20
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# One keep-alive connection to the backend per handler thread
+_local = threading.local()
+
+
+def backend_connection():
+    """Return this thread's connection to BACKEND, creating it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        if BACKEND_URL.scheme == 'https':
+            conn = http.client.HTTPSConnection(BACKEND_URL.hostname, BACKEND_URL.port, timeout=30)
+        else:
+            conn = http.client.HTTPConnection(BACKEND_URL.hostname, BACKEND_URL.port, timeout=30)
+        _local.conn = conn
+    return conn
+
+
+def backend_request(method, path, headers):
+    """Send a request over the kept-alive connection and return the response.
+
+    A closed connection reconnects on the next request, so a backend that
+    dropped the idle connection is retried once.
+    """
+    conn = backend_connection()
+    target = BACKEND_URL.path.rstrip('/') + path
+    try:
+        conn.request(method, target, headers=headers)
+        return conn.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+        conn.close()
+        conn.request(method, target, headers=headers)
+        return conn.getresponse()
+    except Exception:
+        conn.close()
+        raise
+
+
+@functools.lru_cache(maxsize=64)
+def load_static(path, mtime_ns, compress):
+    """Read a static file once per modification: (raw, gzipped or None, etag)."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    gz = gzip.compress(raw) if compress else None
+    return raw, gz, f'"{mtime_ns:x}-{len(raw):x}"'
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip; q=0 rules a coding out."""
+    qvalues = {}
+    for token in accept_encoding.split(','):
+        coding, *params = [p.strip() for p in token.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.lower()] = q
+    # An explicit gzip entry wins over the * wildcard
+    q = qvalues.get('gzip', qvalues.get('x-gzip', qvalues.get('*', 0.0)))
+    return q > 0
+
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # Keep browser connections open between requests
+    protocol_version = 'HTTP/1.1'
+    # Small JSON responses go out immediately instead of waiting on Nagle;
+    # http.client already sets TCP_NODELAY on the backend connection
+    disable_nagle_algorithm = True
+
     def do_GET(self):
         # Proxy API requests to the backend to avoid CORS in the browser
         if self.path.startswith('/api') or self.path == '/health':
-            target = BACKEND + self.path
-            headers = {k: v for k, v in self.headers.items()}
-            req = urllib.request.Request(target, headers=headers)
+            headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
             try:
-                with urllib.request.urlopen(req) as resp:
-                    self.send_response(resp.getcode())
-                    for k, v in resp.getheaders():
-                        # Skip hop-by-hop headers
-                        if k.lower() in ('transfer-encoding', 'connection', 'keep-alive'):
-                            continue
-                        self.send_header(k, v)
-                    self.end_headers()
-                    self.wfile.write(resp.read())
-            except urllib.error.HTTPError as e:
-                self.send_response(e.code)
-                self.end_headers()
-                try:
-                    self.wfile.write(e.read())
-                except Exception:
-                    pass
+                resp = backend_request(self.command, self.path, headers)
             except Exception as e:
+                body = str(e).encode()
                 self.send_response(502)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            try:
+                self.send_response(resp.status)
+                for k, v in resp.getheaders():
+                    # Skip hop-by-hop headers
+                    if k.lower() in HOP_BY_HOP_HEADERS:
+                        continue
+                    self.send_header(k, v)
+                if resp.getheader('Content-Length') is None:
+                    # Body length unknown (chunked upstream); delimit it by closing
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
                 self.end_headers()
-                self.wfile.write(str(e).encode())
+                shutil.copyfileobj(resp, self.wfile)
+            except Exception:
+                # Unread body would poison the kept-alive connection
+                backend_connection().close()
+                raise
         else:
             # Serve static files from the directory this script lives in
             return http.server.SimpleHTTPRequestHandler.do_GET(self)
 
+    def send_head(self):
+        # Small regular files come from the in-memory cache; directories,
+        # missing and large files keep the stock behaviour
+        path = self.translate_path(self.path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if (st is None or not stat.S_ISREG(st.st_mode) or path.endswith('/')
+                or st.st_size > STATIC_CACHE_MAX_BYTES):
+            return super().send_head()
+
+        ctype = self.guess_type(path)
+        # Images and other binary formats are already compressed
+        raw, gz, etag = load_static(path, st.st_mtime_ns, ctype.startswith(COMPRESSIBLE_TYPES))
+        use_gzip = (gz is not None and len(gz) < len(raw)
+                    and accepts_gzip(self.headers.get('Accept-Encoding', '')))
+        if use_gzip:
+            body, etag = gz, etag[:-1] + '-gz"'
+        else:
+            body = raw
+
+        if self.not_modified(etag, st.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def not_modified(self, etag, mtime):
+        # Conditional GET; If-None-Match takes precedence over If-Modified-Since
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            last_modified = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+            return last_modified.replace(microsecond=0) <= since
+        return False
+
+    def copyfile(self, source, outputfile):
+        # Uncached files go straight from the page cache to the socket via
+        # sendfile(2); socket.sendfile falls back to send() for in-memory
+        # bodies and where sendfile is unsupported
+        if outputfile is self.wfile:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
 if __name__ == '__main__':
     os.chdir(os.path.dirname(__file__) or '.')
-    with socketserver.TCPServer(('', PORT), Handler) as httpd:
+    # Threaded so slow backend calls don't block static files. Its handler
+    # threads are daemonic, so Ctrl-C doesn't wait on idle keep-alive clients.
+    with http.server.ThreadingHTTPServer(('', PORT), Handler) as httpd:
         print(f'Serving web_app on http://localhost:{PORT} (proxy to {BACKEND})')
         try:
             httpd.serve_forever()